@@ -7,20 +7,39 @@ Based on: https://learn.microsoft.com/en-us/azure/ai-foundry/openai/supported-la
 
 import os
 import json
+import argparse
+import asyncio
 import logging
 import sys
+import httpx
 from dotenv import load_dotenv
-from openai import AzureOpenAI
-from openai import APIError, APIConnectionError, RateLimitError, APITimeoutError
-import requests
 
 # Load environment variables
 load_dotenv()
 
-# Enable detailed logging for debugging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logging.getLogger("openai").setLevel(logging.DEBUG)
-logging.getLogger("urllib3").setLevel(logging.DEBUG)
+def enable_debug_logging():
+    """Enable detailed logging for debugging (slows every request, so opt-in)."""
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logging.getLogger("openai").setLevel(logging.DEBUG)
+    logging.getLogger("httpx").setLevel(logging.DEBUG)
+    logging.getLogger("urllib3").setLevel(logging.DEBUG)
+
+AZURE_MANAGEMENT_URL = "https://management.azure.com/"
+NOT_PROBED = object()  # Sentinel: the check should run its own probe
+
+async def probe_url(client, url):
+    """GET a URL and return the exception raised, or None if it answered."""
+    try:
+        await client.get(url)
+        return None
+    except Exception as e:
+        return e
+
+async def run_probes(urls):
+    """Probe all URLs concurrently so their timeouts overlap instead of adding up."""
+    async with httpx.AsyncClient(timeout=10) as client:
+        results = await asyncio.gather(*[probe_url(client, url) for url in urls])
+    return dict(zip(urls, results))
 
 def check_environment():
     """Check environment variables."""
@@ -69,26 +88,28 @@ def check_endpoint_format():
     print()
     return True
 
-def test_basic_connectivity():
+def test_basic_connectivity(probe_error=NOT_PROBED):
     """Test basic internet connectivity to Azure."""
     print("🔍 Testing Basic Connectivity...")
     
-    try:
-        response = requests.get("https://management.azure.com/", timeout=10)
+    if probe_error is NOT_PROBED:
+        probe_error = asyncio.run(run_probes([AZURE_MANAGEMENT_URL]))[AZURE_MANAGEMENT_URL]
+    
+    if probe_error is None:
         print("   ✅ Can reach Azure management endpoint")
-    except requests.exceptions.ConnectTimeout:
+    elif isinstance(probe_error, httpx.ConnectTimeout):
         print("   ❌ Connection timeout to Azure - check internet/firewall")
         return False
-    except requests.exceptions.ConnectionError:
+    elif isinstance(probe_error, httpx.ConnectError):
         print("   ❌ Connection error to Azure - check internet connection")
         return False
-    except Exception as e:
-        print(f"   ⚠️  Unexpected error: {e}")
+    else:
+        print(f"   ⚠️  Unexpected error: {probe_error}")
     
     print()
     return True
 
-def test_endpoint_reachability():
+def test_endpoint_reachability(probe_error=NOT_PROBED):
     """Test if the specific Azure OpenAI endpoint is reachable."""
     print("🔍 Testing Azure OpenAI Endpoint Reachability...")
     
@@ -97,18 +118,20 @@ def test_endpoint_reachability():
         print("   ❌ No endpoint to test")
         return False
     
-    try:
+    if probe_error is NOT_PROBED:
         # Just test if we can reach the endpoint
-        response = requests.get(endpoint, timeout=10)
+        probe_error = asyncio.run(run_probes([endpoint]))[endpoint]
+    
+    if probe_error is None:
         print(f"   ✅ Can reach endpoint: {endpoint}")
-    except requests.exceptions.ConnectTimeout:
+    elif isinstance(probe_error, httpx.ConnectTimeout):
         print(f"   ❌ Connection timeout to {endpoint}")
         return False
-    except requests.exceptions.ConnectionError:
+    elif isinstance(probe_error, httpx.ConnectError):
         print(f"   ❌ Connection error to {endpoint}")
         return False
-    except Exception as e:
-        print(f"   ⚠️  Response from endpoint (may be expected): {e}")
+    else:
+        print(f"   ⚠️  Response from endpoint (may be expected): {probe_error}")
     
     print()
     return True
@@ -117,6 +140,10 @@ def test_openai_client():
     """Test Azure OpenAI client initialization and API call with detailed debugging."""
     print("🔍 Testing Azure OpenAI Client...")
     
+    # Imported here: the SDK is heavy and only this check needs it
+    from openai import AzureOpenAI
+    from openai import APIError, APIConnectionError
+    
     # Validate required environment variables first
     api_key = os.getenv("AZURE_OPENAI_API_KEY")
     endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
@@ -271,17 +298,28 @@ def test_alternative_auth():
 
 def main():
     """Run all diagnostic checks."""
+    parser = argparse.ArgumentParser(description="Diagnose Azure OpenAI connection issues.")
+    parser.add_argument("--verbose", action="store_true", help="Enable DEBUG logging for openai/httpx")
+    args = parser.parse_args()
+    
+    if args.verbose:
+        enable_debug_logging()
+    
     print("🚀 Azure OpenAI Connection Diagnostics")
     print("Based on: https://learn.microsoft.com/en-us/azure/ai-foundry/openai/supported-languages")
     print("=" * 80)
     print()
     
+    # Fire the network probes together up front; the checks below report them in order
+    endpoint = os.getenv('AZURE_OPENAI_ENDPOINT', '')
+    probes = asyncio.run(run_probes([AZURE_MANAGEMENT_URL] + ([endpoint] if endpoint else [])))
+    
     # Run checks in order
     checks = [
         ("Environment Variables", check_environment),
         ("Endpoint Format", check_endpoint_format),
-        ("Basic Connectivity", test_basic_connectivity),
-        ("Endpoint Reachability", test_endpoint_reachability),
+        ("Basic Connectivity", lambda: test_basic_connectivity(probes[AZURE_MANAGEMENT_URL])),
+        ("Endpoint Reachability", lambda: test_endpoint_reachability(probes.get(endpoint))),
         ("Azure OpenAI Client", test_openai_client),
         ("Alternative Auth", test_alternative_auth)
     ]
@@ -0,0 +1,98 @@
+"""
+Endpoint Pool for Azure OpenAI
+Spreads requests over several Azure OpenAI resources with failover.
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+from openai import APIConnectionError, InternalServerError, RateLimitError
+
+
+class EndpointPool:
+    """Routes each request to the least-loaded healthy endpoint.
+    
+    send_sync() instead stays on one endpoint (the first, initially) and only
+    moves after it fails: sequential requests are usually turns of the same
+    conversation, and Azure's prompt cache is per resource.
+    
+    An endpoint that fails with a rate limit, 5xx or connection error is skipped
+    for cooldown seconds (or as long as its Retry-After asks) and the request is
+    retried on the next one. The error is only raised once every endpoint has been
+    tried. Use send() with async senders and send_sync() with blocking ones.
+    """
+    
+    def __init__(self, senders: List[Callable[[Dict], Awaitable[Any]]], concurrency_limit: int = 32,
+                 cooldown: float = 30.0):
+        self.senders = senders
+        self.cooldown = cooldown
+        self._semaphores = [asyncio.Semaphore(concurrency_limit) for _ in senders]
+        self._in_flight = [0] * len(senders)
+        self._unhealthy_until = [0.0] * len(senders)
+        self._next = 0  # round-robin start, so equally loaded endpoints take turns
+        self._current = 0  # endpoint send_sync keeps using until it fails
+    
+    def _pick(self, tried: List[int]) -> int:
+        """Index of the least-loaded untried endpoint, preferring healthy ones.
+        
+        Ties go round-robin, so concurrent requests that start together are spread.
+        """
+        now = time.monotonic()
+        count = len(self.senders)
+        start = self._next
+        untried = [i % count for i in range(start, start + count) if i % count not in tried]
+        healthy = [i for i in untried if self._unhealthy_until[i] <= now]
+        index = min(healthy or untried, key=self._in_flight.__getitem__)
+        self._next = (index + 1) % count
+        return index
+    
+    def _mark_unhealthy(self, index: int, error: Exception):
+        """Skip an endpoint until its Retry-After (if the error carries one) or the default cooldown passes."""
+        cooldown = self.cooldown
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                cooldown = float(response.headers.get("retry-after", cooldown))
+            except ValueError:
+                pass
+        self._unhealthy_until[index] = time.monotonic() + cooldown
+    
+    async def send(self, request_data: Dict):
+        """Send a request, failing over to other endpoints on transient errors."""
+        tried = []
+        while True:
+            index = self._pick(tried)
+            tried.append(index)
+            
+            self._in_flight[index] += 1
+            try:
+                async with self._semaphores[index]:
+                    return await self.senders[index](request_data)
+            except (RateLimitError, APIConnectionError, InternalServerError) as e:
+                self._mark_unhealthy(index, e)
+                if len(tried) == len(self.senders):
+                    raise
+            finally:
+                self._in_flight[index] -= 1
+    
+    def send_sync(self, request_data: Dict):
+        """Blocking send() for a pool built from synchronous senders; see the class docstring."""
+        tried = []
+        while True:
+            index = self._current
+            if index in tried or self._unhealthy_until[index] > time.monotonic():
+                index = self._pick(tried)
+            tried.append(index)
+            
+            self._in_flight[index] += 1
+            try:
+                result = self.senders[index](request_data)
+                self._current = index
+                return result
+            except (RateLimitError, APIConnectionError, InternalServerError) as e:
+                self._mark_unhealthy(index, e)
+                if len(tried) == len(self.senders):
+                    raise
+            finally:
+                self._in_flight[index] -= 1
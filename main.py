@@ -5,5 +5,5 @@ Simple Azure OpenAI Chat Application
 from simple_chat import SimpleChatApp
 
 if __name__ == "__main__":
-    app = SimpleChatApp()
-    app.run()
+    with SimpleChatApp() as app:
+        app.run()
@@ -0,0 +1,255 @@
+"""
+Response Cache for Azure OpenAI Chat Completions
+Serves repeated deterministic requests from memory (or disk) instead of the network.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    # Optional: only needed for the semantic cache
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    # Optional: faster (de)serialization of stored responses
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _dumps(value: Any) -> str:
+    """Serialize a stored value to JSON text."""
+    if orjson is not None:
+        return orjson.dumps(value, default=str).decode("utf-8")
+    return json.dumps(value, default=str)
+
+
+def _loads(text: str) -> Any:
+    """Parse JSON text written by _dumps."""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+class ResponseCache:
+    """In-process LRU cache with a time-to-live, keyed by a hash of the request body.
+    
+    Safe to share between threads (e.g. tool calls running in a pool).
+    """
+    
+    def __init__(self, max_size: int = 512, ttl: float = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def make_key(canonical_body: bytes) -> str:
+        """Hash a canonical (sorted-key) JSON request body into a cache key."""
+        return hashlib.blake2b(canonical_body, digest_size=16).hexdigest()
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def set(self, key: str, value: Any):
+        """Store a value, evicting the least recently used entry when full."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        """Drop all cached entries."""
+        self._entries.clear()
+    
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss/eviction counters and the current size."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries)
+        }
+
+
+class DiskCache:
+    """SQLite-backed response cache that survives process restarts.
+    
+    Entries are namespaced (e.g. by API version) so a cache directory shared
+    across configurations never serves a response from a different API.
+    """
+    
+    # Pruning scans the table, so it runs periodically rather than on every write
+    PRUNE_EVERY = 100
+    
+    def __init__(self, directory: str, namespace: str = "", ttl: float = 86400, max_entries: int = 10000):
+        os.makedirs(directory, exist_ok=True)
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, "responses.sqlite3"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)")
+        self._db.commit()
+        self._writes = 0
+    
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Return the stored value, or None if missing or expired."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (self._key(key),)
+            ).fetchone()
+        
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return _loads(row[0])
+    
+    def set(self, key: str, value: Any):
+        """Store a JSON-serializable value, pruning expired and oldest entries every PRUNE_EVERY writes."""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at) VALUES (?, ?, ?)",
+                (self._key(key), _dumps(value), now)
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._db.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+                self._db.execute(
+                    "DELETE FROM responses WHERE created_at < "
+                    "(SELECT created_at FROM responses ORDER BY created_at DESC LIMIT 1 OFFSET ?)",
+                    (self.max_entries - 1,)
+                )
+            self._db.commit()
+    
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._db.close()
+
+
+class SemanticCache:
+    """Reuses responses for near-duplicate prompts by comparing embeddings.
+    
+    Only safe for deterministic, tool-free requests: the caller decides
+    eligibility, this class just does nearest-neighbour lookup. Lookups and
+    stores may run on different threads; the embedding matrix and the values
+    are only read and changed together under the lock.
+    """
+    
+    def __init__(self, embed: Callable[[str], List[float]], threshold: float = 0.92, max_size: int = 1000):
+        if np is None:
+            raise ImportError("The semantic cache requires numpy: pip install numpy")
+        
+        self.embed = embed
+        self.threshold = threshold
+        self.max_size = max_size
+        self._matrix = None  # (n, dim) array of unit-length embeddings
+        self._values = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def lookup(self, text: str) -> Tuple[Optional[Any], Optional["np.ndarray"]]:
+        """Return (cached value or None, query embedding) for the given text.
+        
+        The embedding is returned so a miss can be stored without embedding twice.
+        If embedding fails the cache is skipped and (None, None) is returned.
+        """
+        try:
+            query = np.asarray(self.embed(text), dtype=np.float32)
+        except Exception:
+            return None, None
+        
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return None, None
+        query /= norm
+        
+        with self._lock:
+            if self._matrix is not None:
+                similarities = self._matrix @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.hits += 1
+                    return self._values[best], query
+            
+            self.misses += 1
+        return None, query
+    
+    def store(self, embedding: Optional["np.ndarray"], value: Any):
+        """Add an entry, dropping the oldest one when full."""
+        if embedding is None:
+            return
+        
+        row = embedding.reshape(1, -1)
+        with self._lock:
+            self._matrix = row if self._matrix is None else np.vstack([self._matrix, row])
+            self._values.append(value)
+            
+            if len(self._values) > self.max_size:
+                self._matrix = self._matrix[1:]
+                self._values.pop(0)
+    
+    def save(self, path: str):
+        """Write the embeddings and values to an .npz file (values must be JSON-serializable)."""
+        with self._lock:
+            matrix, values = self._matrix, list(self._values)
+        if matrix is None:
+            return
+        
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(path, matrix=matrix, values=np.array(_dumps(values)))
+    
+    def load(self, path: str):
+        """Restore entries written by save(); a missing or unreadable file leaves the cache empty."""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                matrix = data["matrix"]
+                values = _loads(str(data["values"]))
+        except (OSError, KeyError, ValueError):
+            return
+        
+        with self._lock:
+            self._matrix = matrix[-self.max_size:]
+            self._values = values[-self.max_size:]
+    
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and the current size."""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._values)}
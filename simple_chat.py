@@ -3,16 +3,62 @@ Simple Azure OpenAI Chat Application with Tool Calling
 A straightforward chat interface that demonstrates Azure OpenAI API usage.
 """
 
+import ast
+import asyncio
+import atexit
+import contextlib
+import functools
+import hashlib
+import importlib
+import inspect
+import importlib.util
 import json
 import math
 import random
+import re
+import sys
 import time
+import types
 import logging
-from typing import Dict, Any, List
-from openai import AzureOpenAI
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+import httpx
+from openai import AzureOpenAI, AsyncAzureOpenAI
 from openai import APIError, APIConnectionError, RateLimitError, APITimeoutError
+from openai import APIStatusError, AuthenticationError, BadRequestError, NotFoundError, InternalServerError
+from openai.resources.chat.completions import Completions
+from openai.types.chat import ChatCompletion
+from pydantic import ValidationError, create_model
 import os
 from dotenv import load_dotenv
+from response_cache import DiskCache, ResponseCache, SemanticCache
+from endpoint_pool import EndpointPool
+
+try:
+    # Optional: h2 lets httpx multiplex requests over one HTTP/2 connection
+    import h2
+except ImportError:
+    h2 = None
+
+try:
+    # Optional: orjson serializes log entries several times faster than the json module
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional: aiohttp keeps scaling where httpx's async pool stalls under high concurrency.
+# It is only used by batch runs, so it is imported on first use (see _load_aiohttp)
+# rather than adding its import time to every interactive start.
+aiohttp = None
+_AIOHTTP_AVAILABLE = importlib.util.find_spec("aiohttp") is not None
+
+try:
+    # Optional: tiktoken gives exact token counts for history trimming
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
 # Load environment variables
 load_dotenv()
@@ -23,50 +69,514 @@ if os.getenv("DEBUG_AZURE_OPENAI", "").lower() in ["true", "1", "yes"]:
     logging.getLogger("openai").setLevel(logging.DEBUG)
     logging.getLogger("urllib3").setLevel(logging.DEBUG)
 
+logger = logging.getLogger(__name__)
+
+# Stable system prompt. Azure OpenAI caches prompt prefixes only when they match
+# token-for-token, so this text must not contain anything that changes per call.
+# Caching starts at 1024 identical leading tokens; longer fixed instructions can be
+# added via AZURE_OPENAI_STATIC_CONTEXT_FILE so the prefix reaches that size.
+SYSTEM_PROMPT = (
+    "You are a helpful assistant in a command-line chat. Use the available tools "
+    "(weather, math, random numbers, directory listing) when they help answer the user."
+)
+
+# Timestamps and UUID-style request IDs: the usual culprits that break prefix caching
+_DYNAMIC_TOKEN_RE = re.compile(
+    r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(?::\d{2})?"
+    r"|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}",
+    re.IGNORECASE
+)
+
+# Printed once at startup; built here so run() issues a single write
+_BANNER = "\n".join([
+    "🤖 Azure OpenAI Chat with Tool Calling",
+    "=" * 50,
+    "Available tools: weather, math calculator, random numbers, file explorer",
+    "Type 'quit' to exit, 'clear' to reset conversation, 'logs' to view API logs",
+    "Examples: 'What files are in this directory?' or 'List files in the logs folder'\n"
+])
+
+# Tools whose result depends only on their arguments; random numbers and
+# directory listings change between calls and are always re-run
+CACHEABLE_TOOLS = frozenset({"get_weather", "calculate_math"})
+
+# Mock weather table, keyed by casefolded city name; read-only since it is shared by every call
+_WEATHER_DATA = types.MappingProxyType({
+    "san francisco": "sunny, 22°C",
+    "new york": "cloudy, 18°C",
+    "london": "rainy, 15°C",
+    "tokyo": "partly cloudy, 25°C"
+})
+
+
+def _weather_report(location: str) -> str:
+    """Look up the mock weather for a location such as "Tokyo" or "Tokyo, Japan"."""
+    idx = location.find(",")
+    head = location if idx < 0 else location[:idx]
+    conditions = _WEATHER_DATA.get(head.strip().casefold())
+    if conditions is not None:
+        return f"The weather in {location} is {conditions}"
+    return f"Sorry, I don't have weather data for {location}"
+
+
+# One generator per thread, so tool calls running in the pool never share state
+_thread_local = threading.local()
+
+
+def _rng() -> random.Random:
+    rng = getattr(_thread_local, "rng", None)
+    if rng is None:
+        rng = _thread_local.rng = random.Random()
+    return rng
+
+
+def _load_aiohttp():
+    """Import aiohttp the first time a batch needs it; None when it isn't installed."""
+    global aiohttp
+    if aiohttp is None and _AIOHTTP_AVAILABLE:
+        aiohttp = importlib.import_module("aiohttp")
+    return aiohttp
+
+
+# stream_options (usage on the final streamed chunk) needs a newer openai SDK than
+# requirements.txt allows; older ones reject the argument
+_STREAM_USAGE_SUPPORTED = "stream_options" in inspect.signature(Completions.create).parameters
+
+
+# JSON-schema parameter types mapped to the Python types the tool functions expect
+_SCHEMA_TYPES = {"string": str, "integer": int, "number": float, "boolean": bool}
+
+# Longest wait between retries, whatever the server or the backoff asks for
+_MAX_RETRY_DELAY = 30.0
+
+# Log entries that may wait for the writer before new ones are dropped
+_LOG_QUEUE_SIZE = 1024
+
+# Queued log entries written between flushes while a backlog is draining
+_LOG_FLUSH_EVERY = 64
+
+# Share of the history limits kept after a trim
+_HISTORY_TRIM_RATIO = 0.5
+
+# Rotated log files kept next to the live one
+_LOG_BACKUPS = 3
+
+# Tools whose result is already a complete sentence for the user, mapped to the
+# prefix of a successful result; a lone successful call to one of these is
+# answered with its result instead of a second model request
+DIRECT_REPLY_TOOLS = types.MappingProxyType({
+    "get_weather": "The weather in ",
+    "generate_random_number": "Random number between ",
+})
+
+# Inputs that end the interactive loop
+_QUIT_COMMANDS = frozenset({"quit", "exit", "q"})
+
+# Header names (lower-case) whose values must never reach the log file
+SENSITIVE_HEADERS = frozenset({"api-key", "authorization", "x-api-key"})
+
+
+def _sanitize_headers(headers) -> Dict[str, str]:
+    """Copy headers with credential values redacted, in a single pass."""
+    return {k: ("[REDACTED]" if k.lower() in SENSITIVE_HEADERS else v) for k, v in headers.items()}
+
+
+def build_cached_messages(system_prompt: str, static_context: str, user_turn: str) -> List[Dict]:
+    """Build messages as [system, static context, user] with a byte-stable prefix.
+    
+    Server-side prompt caching only applies to an exact prefix match, so dynamic
+    tokens found in the system prompt are moved to the end of the user turn.
+    """
+    dynamic_tokens = [m.group(0) for m in _DYNAMIC_TOKEN_RE.finditer(system_prompt)]
+    system_prompt = " ".join(_DYNAMIC_TOKEN_RE.sub("", system_prompt).split())
+    
+    messages = [{"role": "system", "content": system_prompt}]
+    if static_context:
+        messages.append({"role": "system", "content": static_context.strip()})
+    if dynamic_tokens:
+        user_turn = f"{user_turn}\n\n(Context: {', '.join(dynamic_tokens)})"
+    messages.append({"role": "user", "content": user_turn})
+    return messages
+
+
+_encoding = None
+
+
+def _count_tokens(message: Dict) -> int:
+    """Approximate prompt tokens for one message (exact when tiktoken is available)."""
+    global _encoding
+    
+    text = message.get("content") or ""
+    for tool_call in message.get("tool_calls") or ():
+        function = tool_call["function"]
+        text += function["name"] + function["arguments"]
+    
+    if tiktoken is not None and _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = False  # e.g. offline and not cached yet: fall back to the estimate
+    
+    if _encoding:
+        return len(_encoding.encode(text)) + 4
+    return len(text) // 4 + 4
+
+
+# Names calculate_math may use, built once at import
+_ALLOWED_MATH_NAMES = types.MappingProxyType({
+    **{k: v for k, v in math.__dict__.items() if not k.startswith("__")},
+    "abs": abs, "round": round, "min": min, "max": max
+})
+
+
+# Syntax calculate_math accepts: arithmetic and comparisons on numbers, allowed names,
+# calls to them and a list/tuple as a call's only argument (e.g. max([1, 2])). Only
+# arithmetic operators: shifts and container repetition could allocate gigabytes
+_MATH_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Load,
+    ast.Constant, ast.List, ast.Tuple, ast.cmpop,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.USub, ast.UAdd
+)
+
+# Largest integer power result (in bits) calculate_math will compute; beyond this
+# a single "**" could take minutes and gigabytes
+_MAX_POW_BITS = 10_000
+
+# Longest result text calculate_math returns; it goes back into the conversation
+_MAX_MATH_RESULT_CHARS = 4000
+
+
+def _checked_pow(base, exponent):
+    """base ** exponent, refusing integer results larger than _MAX_POW_BITS."""
+    if isinstance(base, int) and isinstance(exponent, int) and exponent > 0 and abs(base) > 1:
+        if exponent * math.log2(abs(base)) > _MAX_POW_BITS:
+            raise ValueError("result too large")
+    return base ** exponent
+
+
+class _PowToCheckedCall(ast.NodeTransformer):
+    """Rewrite every a ** b into _checked_pow(a, b) so the cap holds at evaluation time."""
+    
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.op, ast.Pow):
+            return node
+        return ast.Call(func=ast.Name(id="_checked_pow", ctx=ast.Load()), args=[node.left, node.right], keywords=[])
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_expression(expression: str):
+    """Parse, check and compile a math expression once; repeated expressions skip all three.
+    
+    Anything outside _MATH_NODES (attribute access, subscripts, lambdas, ...) or a
+    name that isn't in _ALLOWED_MATH_NAMES is rejected before it can run. Powers
+    are compiled as _checked_pow calls.
+    """
+    tree = ast.parse(expression, mode="eval")
+    sole_args = {id(node.args[0]) for node in ast.walk(tree) if isinstance(node, ast.Call) and len(node.args) == 1}
+    for node in ast.walk(tree):
+        if not isinstance(node, _MATH_NODES):
+            raise ValueError(f"unsupported syntax: {type(node).__name__}")
+        if isinstance(node, (ast.List, ast.Tuple)) and id(node) not in sole_args:
+            raise ValueError("lists and tuples are only allowed as the single argument of a function")
+        if isinstance(node, ast.Name) and node.id not in _ALLOWED_MATH_NAMES:
+            raise ValueError(f"unknown name: {node.id}")
+        if isinstance(node, ast.Call) and (node.keywords or not isinstance(node.func, ast.Name)):
+            raise ValueError("only plain calls to math functions are allowed")
+        if isinstance(node, ast.Constant) and type(node.value) not in (int, float, complex):
+            raise ValueError("only numeric constants are allowed")
+    tree = ast.fix_missing_locations(_PowToCheckedCall().visit(tree))
+    return compile(tree, "<math>", "eval")
+
+
+def _evaluate_math(expression: str) -> str:
+    """Evaluate an expression with only the allowed math names in scope; returns the result as text."""
+    result = str(eval(_compile_expression(expression), {"__builtins__": {}, "_checked_pow": _checked_pow}, _ALLOWED_MATH_NAMES))
+    if len(result) > _MAX_MATH_RESULT_CHARS:
+        raise ValueError("result too large")
+    return result
+
+
+# A message that is nothing but arithmetic (e.g. "12 * (3 + 4)" or "2 ** 10")
+_PURE_MATH_RE = re.compile(r"[\d\s.()]*\d[\d\s.()]*(?:(?:\*\*|[-+*/%])[\d\s.()]+)+")
+
+# Digit runs that look like data rather than arithmetic: numbers with a leading zero,
+# dates ("2024-10-15"), phone numbers ("555-1234") and whole messages of integers
+# joined only by "-", i.e. ranges and scores ("3-4", "10 - 12"); these go to the model
+_NOT_MATH_RE = re.compile(r"\b0\d|\d{3,4}-\d{2,4}(?:-\d+)?|\A\d+(?:\s*-\s*\d+)+\Z")
+
+
+def prefix_cache_key(system_prompt: str, static_context: str = "") -> str:
+    """Short stable key for a prompt prefix, used to route requests to a warm cache."""
+    return hashlib.blake2b(f"{system_prompt}\0{static_context}".encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _tool_call_message(message) -> Dict:
+    """History entry for an assistant message with tool calls, in the same shape the stream builds.
+    
+    Reads only the fields the conversation needs rather than a second full model_dump().
+    """
+    return {
+        "role": "assistant",
+        "content": message.content,
+        "tool_calls": [
+            {
+                "id": tool_call.id,
+                "type": "function",
+                "function": {"name": tool_call.function.name, "arguments": tool_call.function.arguments}
+            }
+            for tool_call in message.tool_calls
+        ]
+    }
+
+
+def _dumps_canonical(obj) -> bytes:
+    """Compact JSON with sorted keys: one serialization shared by cache keys and logs."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str)
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def _loads(data):
+    """Parse JSON text or bytes, using orjson when it is installed (raises ValueError)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _dumps_compact(obj) -> bytes:
+    """Compact JSON as UTF-8 bytes, keeping key order, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS, default=str)
+    return json.dumps(obj, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def _dumps_indented(obj) -> bytes:
+    """Pretty-print JSON as UTF-8 bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS, default=str)
+    return json.dumps(obj, indent=2, default=str).encode("utf-8")
+
+
+# Fixed log fragments, serialized once instead of in every entry
+_LOG_REQUEST_HEADERS = _dumps_compact({"api-key": "[REDACTED]", "Content-Type": "application/json"})
+_LOG_RESPONSE_HEADERS = _dumps_compact({"content-type": "application/json"})
+
 
 class SimpleChatApp:
     """Simple chat application with Azure OpenAI and tool calling."""
     
     def __init__(self):
+        # Tool-call progress and error diagnostics go to stdout unless AZURE_OPENAI_VERBOSE=false
+        self.verbose = os.getenv("AZURE_OPENAI_VERBOSE", "true").lower() in ["true", "1", "yes"]
+        
         # Validate configuration first
         self._validate_config()
         
-        # Initialize Azure OpenAI client with exact parameters from documentation
-        # Handle SSL certificate issues in corporate environments
-        import ssl
-        import httpx
+        # API calls are logged by a background thread so file I/O stays off the request path
+        self.log_file = "logs/api_requests.txt"
+        self.enable_logging = os.getenv("AZURE_OPENAI_LOG_REQUESTS", "true").lower() in ["true", "1", "yes"]
+        if self.enable_logging:
+            os.makedirs("logs", exist_ok=True)
+            self._log_fh = open(self.log_file, "ab", buffering=1 << 20)
+            # Bounded so a burst of batch calls can't pile up unwritten entries in memory;
+            # entries that don't fit are dropped and counted
+            self._log_queue = queue.Queue(maxsize=_LOG_QUEUE_SIZE)
+            self._log_dropped = 0
+            # Response bodies are written compact unless AZURE_OPENAI_LOG_PRETTY=true
+            pretty = os.getenv("AZURE_OPENAI_LOG_PRETTY", "").lower() in ["true", "1", "yes"]
+            self._log_dumps = _dumps_indented if pretty else _dumps_compact
+            # Past this size the log rolls over to api_requests.txt.1 (.2, .3); 0 never rotates
+            self.log_max_bytes = int(os.getenv("AZURE_OPENAI_LOG_MAX_BYTES", "5000000"))
+            threading.Thread(target=self._log_worker, daemon=True).start()
+            atexit.register(self._flush_logs)
         
+        # Initialize Azure OpenAI client with exact parameters from documentation
         # Check if SSL verification should be disabled (corporate environments)
-        disable_ssl = os.getenv("DISABLE_SSL_VERIFY", "").lower() in ["true", "1", "yes"]
+        self.disable_ssl = os.getenv("DISABLE_SSL_VERIFY", "").lower() in ["true", "1", "yes"]
         
-        if disable_ssl:
+        # Shared by the sync client and the async batch client
+        self._client_options = {
+            "api_key": os.getenv("AZURE_OPENAI_API_KEY"),
+            "azure_endpoint": os.getenv("AZURE_OPENAI_ENDPOINT"),
+            "api_version": os.getenv("AZURE_OPENAI_API_VERSION", "2024-10-21"),
+            # 429s, 5xx and dropped connections are retried with exponential backoff
+            "max_retries": int(os.getenv("AZURE_OPENAI_MAX_RETRIES", "2")),
+            # Fail fast on an unreachable endpoint, but give long replies time to generate
+            "timeout": httpx.Timeout(float(os.getenv("AZURE_OPENAI_TIMEOUT", "60")), connect=5.0)
+        }
+        self.retry_base_delay = 1.0
+        self._backoff_until = 0.0  # monotonic time before which batch requests hold off after a 429/503
+        
+        if self.disable_ssl:
             print("⚠️  SSL verification disabled (corporate environment)")
-            # Create custom HTTP client that doesn't verify SSL
-            http_client = httpx.Client(verify=False)
-            self.client = AzureOpenAI(
-                api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-                azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-                api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-10-21"),
-                http_client=http_client
-            )
-        else:
-            self.client = AzureOpenAI(
-                api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-                azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-                api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-10-21")
-            )
         
-        self.deployment_name = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")
-        self.conversation = []
+        # One long-lived HTTP client so every call reuses the same warm TCP+TLS connection;
+        # idle connections outlive a typical pause between interactive turns
+        self._http_limits = httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=120)
+        self._http = httpx.Client(
+            http2=h2 is not None,
+            verify=not self.disable_ssl,
+            limits=self._http_limits
+        )
+        self.client = AzureOpenAI(**self._client_options, http_client=self._http)
+        
+        # A smaller chat deployment (e.g. gpt-4o-mini) answers noticeably faster
+        self.deployment_name = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT_NAME") or os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")
+        
+        # The system prompt (plus optional static context) stays first and unchanged so
+        # Azure can reuse its cached prefix; only the history after it varies
+        self.static_context = self._load_static_context()
+        self._prefix_messages = build_cached_messages(SYSTEM_PROMPT, self.static_context, "")[:-1]
+        self.conversation = list(self._prefix_messages)
+        
+        # Opt-in routing hint so requests sharing this prefix land where it is already cached
+        self.use_prompt_cache_key = os.getenv("AZURE_OPENAI_PROMPT_CACHE_KEY", "").lower() in ["true", "1", "yes"]
+        self._prompt_cache_key = prefix_cache_key(SYSTEM_PROMPT, self.static_context)
+        # Prompt tokens sent vs. served from the service's prefix cache (see prompt_cache_stats)
+        self._prompt_token_totals = {"prompt_tokens": 0, "cached_tokens": 0}
+        
+        # History beyond this many tokens is dropped oldest-turn-first (0 disables trimming)
+        self.max_history_tokens = int(os.getenv("AZURE_OPENAI_MAX_HISTORY_TOKENS", "4000"))
+        # ...and beyond this many user turns, however short they are (0 disables)
+        self.max_history_turns = int(os.getenv("AZURE_OPENAI_MAX_HISTORY_TURNS", "20"))
+        self._history_tokens = []  # token count per history message, parallel to conversation
+        
+        # Built once: used by the aiohttp batch path and in every log entry
+        api_version = self._client_options["api_version"]
+        self._chat_endpoint = self._chat_url(self._client_options)
+        
+        # Sampling temperature; near 0 responses are (close to) deterministic and therefore cacheable
+        self.temperature = float(os.getenv("AZURE_OPENAI_TEMPERATURE", "1"))
+        self.cache_max_temperature = float(os.getenv("AZURE_OPENAI_CACHE_MAX_TEMPERATURE", "0.1"))
+        self.response_cache = ResponseCache()
+        self.cache_dir = os.getenv("AZURE_OPENAI_CACHE_DIR", ".cache/azure_openai")
+        self.disk_cache = self._create_disk_cache()
+        
+        # A passing startup connection test is trusted for this long (0 always tests)
+        self.connection_check_ttl = float(os.getenv("AZURE_OPENAI_CONNECTION_CHECK_TTL", "300"))
+        # Skip the test request altogether; the first real message surfaces any problem
+        self.skip_connection_test = os.getenv("AZURE_OPENAI_SKIP_CONNECTION_TEST", "").lower() in ["true", "1", "yes"]
+        self._connection_stamp_path = os.path.join(self.cache_dir, "last_ok")
+        self.semantic_cache = self._create_semantic_cache()
+        
+        # Upper bound on in-flight requests per endpoint for chat_batch (respects rate limits)
+        self.max_concurrent_requests = 32
+        self._inflight = {}  # cache key -> pending request, so duplicates share one call
+        
+        # Extra Azure OpenAI resources (AZURE_OPENAI_ENDPOINT_2, _3, ...) that share batch load
+        # and take over interactive requests while the main one is rate limited or down
+        self._pool_options = self._load_pool_options()
+        self._send = self._create_chat_sender()
+        
+        # Legacy completions accept a list of prompts but need a completions-capable
+        # deployment; without one, complete_batch goes through chat completions
+        self.completions_deployment = os.getenv("AZURE_OPENAI_COMPLETIONS_DEPLOYMENT_NAME")
+        self._completions_endpoint = f"{self._client_options['azure_endpoint']}openai/deployments/{self.completions_deployment}/completions?api-version={api_version}"
+        self.max_prompts_per_request = 20
+        
+        # Offline jobs go through the Batch API, which needs a Global-Batch deployment
+        self.batch_deployment = os.getenv("AZURE_OPENAI_BATCH_DEPLOYMENT_NAME", self.deployment_name)
+        self.batch_poll_interval = 30.0
         
         # Set up available tools
         self.tools = self._setup_tools()
+        self._tools_by_name = {tool["function"]["name"]: tool for tool in self.tools}
+        # Pre-serialized JSON per tools list, by identity: (list, bytes) so the id stays valid
+        self._tools_json = {id(self.tools): (self.tools, _dumps_canonical(self.tools))}
+        self._restricted_chats = {}
+        self._tool_validators = self._build_tool_validators()
         self.available_functions = {
             "get_weather": self._get_weather,
             "calculate_math": self._calculate_math,
             "generate_random_number": self._generate_random_number,
             "list_directory_files": self._list_directory_files
         }
+        self.tool_cache = ResponseCache(max_size=512)
+        # Independent tool calls from one assistant message run side by side
+        self._tool_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="tool")
+        
+        # Interactive replies are printed as they stream in unless AZURE_OPENAI_STREAM=false
+        self.stream_replies = os.getenv("AZURE_OPENAI_STREAM", "true").lower() in ["true", "1", "yes"]
+        
+        # Request shapes used on every turn, bound once; only the messages vary per call
+        self._chat_with_tools = self.prepare_chat(tools=self.tools)
+        self._chat_plain = self.prepare_chat()
+        self._batch_request = self._base_request()
+    
+    def close(self):
+        """Write out pending log entries, close the log file and release pooled connections."""
+        if self.enable_logging:
+            self._log_queue.join()
+            self._log_fh.close()
+        self._http.close()
+        self._tool_executor.shutdown(wait=False)
+        if self.disk_cache is not None:
+            if self.semantic_cache is not None:
+                self.semantic_cache.save(self._semantic_cache_path)
+            self.disk_cache.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    def _load_static_context(self) -> str:
+        """Read fixed reference text sent after the system prompt (AZURE_OPENAI_STATIC_CONTEXT_FILE)."""
+        path = os.getenv("AZURE_OPENAI_STATIC_CONTEXT_FILE")
+        if not path:
+            return ""
+        
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError as e:
+            print(f"⚠️  Static context not loaded: {e}")
+            return ""
+    
+    def _connection_stamp_key(self) -> str:
+        return f"{self._client_options['azure_endpoint']}|{self.deployment_name}|{self._client_options['api_version']}"
+    
+    def _connection_recently_verified(self) -> bool:
+        """True if this configuration passed the connection test within connection_check_ttl seconds."""
+        if not self.connection_check_ttl:
+            return False
+        
+        try:
+            with open(self._connection_stamp_path, "r", encoding="utf-8") as f:
+                stamp = json.load(f)
+        except (OSError, ValueError):
+            return False
+        
+        return stamp.get("key") == self._connection_stamp_key() and time.time() - stamp.get("at", 0) < self.connection_check_ttl
+    
+    def _record_connection_ok(self):
+        """Remember a successful connection test so the next start can skip it."""
+        if not self.connection_check_ttl:
+            return
+        
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self._connection_stamp_path, "w", encoding="utf-8") as f:
+                json.dump({"key": self._connection_stamp_key(), "at": time.time()}, f)
+        except OSError:
+            pass
+    
+    def _warm_connection(self):
+        """Open the pooled connection ahead of time so the TLS handshake isn't timed."""
+        try:
+            self._http.head(self._client_options["azure_endpoint"], timeout=5)
+        except httpx.HTTPError:
+            # The real request below reports connection problems in detail
+            pass
+    
+    def _say(self, message: str):
+        """Progress and diagnostic output: printed when verbose, else debug-logged."""
+        if self.verbose:
+            print(message)
+        else:
+            logger.debug(message)
     
     def _validate_config(self):
         """Validate required environment variables."""
@@ -80,25 +590,29 @@ class SimpleChatApp:
         
         # Show configuration for debugging
         endpoint = os.getenv('AZURE_OPENAI_ENDPOINT', '')
-        deployment = os.getenv('AZURE_OPENAI_DEPLOYMENT_NAME', '')
+        # The deployment chat requests actually use (see self.deployment_name)
+        deployment = os.getenv('AZURE_OPENAI_CHAT_DEPLOYMENT_NAME') or os.getenv('AZURE_OPENAI_DEPLOYMENT_NAME', '')
         api_version = os.getenv('AZURE_OPENAI_API_VERSION', '2024-10-21')
         api_key = os.getenv('AZURE_OPENAI_API_KEY', '')
         
-        print(f"📋 Configuration loaded:")
-        print(f"   Endpoint: {endpoint}")
-        print(f"   Deployment: {deployment}")
-        print(f"   API Version: {api_version}")
-        print(f"   API Key: {'***' + api_key[-4:] if len(api_key) > 4 else 'Too Short or Missing'}")
+        # Collected and written in one go rather than line by line
+        lines = [
+            f"📋 Configuration loaded:",
+            f"   Endpoint: {endpoint}",
+            f"   Deployment: {deployment}",
+            f"   API Version: {api_version}",
+            f"   API Key: {'***' + api_key[-4:] if len(api_key) > 4 else 'Too Short or Missing'}"
+        ]
         
         # Validate endpoint format (should end with / or be in correct format)
         if endpoint and not endpoint.endswith('/'):
-            print(f"   ⚠️  Endpoint should end with '/' - current: {endpoint}")
+            lines.append(f"   ⚠️  Endpoint should end with '/' - current: {endpoint}")
         
         # Validate endpoint contains openai.azure.com
         if endpoint and 'openai.azure.com' not in endpoint:
-            print(f"   ⚠️  Endpoint should contain 'openai.azure.com' - current: {endpoint}")
+            lines.append(f"   ⚠️  Endpoint should contain 'openai.azure.com' - current: {endpoint}")
         
-        print()
+        print("\n".join(lines) + "\n")
     
     def _setup_tools(self):
         """Define available tools for the AI."""
@@ -177,27 +691,13 @@ class SimpleChatApp:
     
     def _get_weather(self, location: str) -> str:
         """Mock weather function."""
-        weather_data = {
-            "san francisco": "sunny, 22°C",
-            "new york": "cloudy, 18°C", 
-            "london": "rainy, 15°C",
-            "tokyo": "partly cloudy, 25°C"
-        }
-        
-        location_key = location.lower()
-        if location_key in weather_data:
-            return f"The weather in {location} is {weather_data[location_key]}"
-        else:
-            return f"Sorry, I don't have weather data for {location}"
+        return _weather_report(location)
     
     def _calculate_math(self, expression: str) -> str:
         """Safely calculate math expressions."""
         try:
             # Only allow safe mathematical operations
-            allowed_names = {k: v for k, v in math.__dict__.items() if not k.startswith("__")}
-            allowed_names.update({"abs": abs, "round": round, "min": min, "max": max})
-            
-            result = eval(expression, {"__builtins__": {}}, allowed_names)
+            result = _evaluate_math(expression)
             return f"The result of {expression} is {result}"
         except Exception as e:
             return f"Error calculating {expression}: {str(e)}"
@@ -207,7 +707,7 @@ class SimpleChatApp:
         if min_value > max_value:
             min_value, max_value = max_value, min_value
         
-        number = random.randint(min_value, max_value)
+        number = _rng().randrange(min_value, max_value + 1)
         return f"Random number between {min_value} and {max_value}: {number}"
     
     def _list_directory_files(self, path: str = ".", show_hidden: bool = False) -> str:
@@ -300,131 +800,518 @@ class SimpleChatApp:
         except Exception as e:
             return f"Error listing directory '{path}': {str(e)}"
     
-    def _log_api_call(self, messages: List[Dict], response=None, error_details: Dict = None, duration: float = None):
-        """Enhanced API logging with actual HTTP response details."""
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+    def _log_api_call(self, request_body: bytes, response=None, error_details: Dict = None,
+                      duration: float = None, endpoint: str = None):
+        """Queue an API call for the background log writer.
         
-        # Build the request details
-        request_data = {
-            "model": self.deployment_name,
-            "messages": messages,
-            "tools": self.tools,
-            "max_completion_tokens": 500,
-            "temperature": 1
-        }
+        request_body is the canonical JSON already built for the request, so the
+        log never re-serializes it (and later conversation changes can't leak in).
+        """
+        if not self.enable_logging:
+            return
         
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            self._log_queue.put_nowait((timestamp, request_body, response, error_details, duration, endpoint))
+        except queue.Full:
+            self._log_dropped += 1
+    
+    def _format_log_entry(self, timestamp: str, request_body: bytes, response=None,
+                          error_details: Dict = None, duration: float = None, endpoint: str = None) -> bytes:
+        """Enhanced API logging with actual HTTP response details."""
         # Note: The actual API client handles the full URL construction internally
         # This is just for logging purposes to show what endpoint would be called
-        api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2024-10-21")
-        endpoint = f"{os.getenv('AZURE_OPENAI_ENDPOINT')}openai/deployments/{self.deployment_name}/chat/completions?api-version={api_version}"
-        headers = {
-            "api-key": "[REDACTED]",
-            "Content-Type": "application/json"
-        }
-        
-        log_entry = f"\n=== API REQUEST [{timestamp}] ===\n"
-        log_entry += f"Endpoint: {endpoint}\n"
-        log_entry += f"Method: POST\n"
-        log_entry += f"Headers: {json.dumps(headers, indent=2)}\n"
-        log_entry += f"Request Body: {json.dumps(request_data, indent=2)}\n"
+        parts = [
+            f"\n=== API REQUEST [{timestamp}] ===\n".encode(),
+            f"Endpoint: {endpoint or self._chat_endpoint}\n".encode(),
+            b"Method: POST\n",
+            b"Headers: ", _LOG_REQUEST_HEADERS, b"\n",
+            b"Request Body: ", request_body, b"\n"
+        ]
         
         if response:
-            # Successful response
-            log_entry += f"\n=== API RESPONSE ===\n"
-            log_entry += f"Status Code: 200\n"
-            log_entry += f"Response Headers: {json.dumps({'content-type': 'application/json'}, indent=2)}\n"
-            log_entry += f"Response Body: {json.dumps(response, indent=2)}\n"
+            # Successful response; a ChatCompletion is dumped here, on the writer thread
+            if isinstance(response, ChatCompletion):
+                response = response.model_dump()
+            parts += [
+                b"\n=== API RESPONSE ===\n",
+                b"Status Code: 200\n",
+                b"Response Headers: ", _LOG_RESPONSE_HEADERS, b"\n",
+                b"Response Body: ", self._log_dumps(response), b"\n"
+            ]
             if duration:
-                log_entry += f"Duration: {duration:.3f}s\n"
+                parts.append(f"Duration: {duration:.3f}s\n".encode())
         
         elif error_details:
             # Error response with actual HTTP details
-            log_entry += f"\n=== API ERROR RESPONSE ===\n"
-            log_entry += f"Status Code: {error_details.get('status_code', 500)}\n"
-            log_entry += f"Error Type: {error_details.get('error_type', 'Unknown')}\n"
-            log_entry += f"Error Details: {json.dumps(error_details.get('error_body', {}), indent=2)}\n"
+            parts += [
+                b"\n=== API ERROR RESPONSE ===\n",
+                f"Status Code: {error_details.get('status_code', 500)}\n".encode(),
+                f"Error Type: {error_details.get('error_type', 'Unknown')}\n".encode()
+            ]
+            if "response_headers" in error_details:
+                parts += [b"Response Headers: ", _dumps_indented(error_details["response_headers"]), b"\n"]
+            parts += [
+                b"Error Details: ", self._log_dumps(error_details.get("error_body", {})), b"\n"
+            ]
             if duration:
-                log_entry += f"Duration: {duration:.3f}s\n"
+                parts.append(f"Duration: {duration:.3f}s\n".encode())
         
-        log_entry += "=" * 50 + "\n"
+        parts.append(b"=" * 50 + b"\n")
         
-        # Ensure logs directory exists
-        os.makedirs("logs", exist_ok=True)
-        
-        with open("logs/api_requests.txt", "a", encoding="utf-8") as f:
-            f.write(log_entry)
+        return b"".join(parts)
     
-    def _call_function(self, function_name: str, arguments: Dict) -> str:
-        """Execute a function call."""
-        if function_name in self.available_functions:
+    def _log_worker(self):
+        """Write queued log entries to the persistent log file handle."""
+        written = 0
+        reported_drops = 0
+        while True:
+            entry = self._log_queue.get()
             try:
-                return self.available_functions[function_name](**arguments)
+                dropped = self._log_dropped
+                if dropped > reported_drops:
+                    self._log_fh.write(f"\n[{dropped - reported_drops} log entries dropped: writer fell behind]\n".encode())
+                    reported_drops = dropped
+                self._log_fh.write(self._format_log_entry(*entry))
+                written += 1
+                if self.log_max_bytes and self._log_fh.tell() > self.log_max_bytes:
+                    self._rotate_log()
+                # Flush once the backlog drains (or every N entries during a long burst)
+                # so the file stays current without per-entry syscalls
+                if self._log_queue.empty() or written % _LOG_FLUSH_EVERY == 0:
+                    self._log_fh.flush()
             except Exception as e:
-                return f"Error executing {function_name}: {str(e)}"
-        else:
+                print(f"⚠️  Failed to write API log entry: {e}")
+            finally:
+                self._log_queue.task_done()
+    
+    def _rotate_log(self):
+        """Shift api_requests.txt to .1 (and .1 to .2, ...), keeping _LOG_BACKUPS old files.
+        
+        The live file is always reopened, so a failed rename only delays rotation
+        instead of leaving the writer with a closed handle.
+        """
+        self._log_fh.close()
+        try:
+            for index in range(_LOG_BACKUPS - 1, 0, -1):
+                older = f"{self.log_file}.{index}"
+                if os.path.exists(older):
+                    os.replace(older, f"{self.log_file}.{index + 1}")
+            os.replace(self.log_file, f"{self.log_file}.1")
+        finally:
+            self._log_fh = open(self.log_file, "ab", buffering=1 << 20)
+    
+    def _flush_logs(self):
+        """Wait until every queued log entry is on disk (a no-op after close())."""
+        if not self.enable_logging or self._log_fh.closed:
+            return
+        self._log_queue.join()
+        self._log_fh.flush()
+    
+    def _build_tool_validators(self) -> Dict:
+        """Generate one argument model per tool schema, once.
+        
+        Each validator checks and coerces the model's arguments (e.g. "5" -> 5),
+        drops unknown keys and leaves unset optional arguments to the function's defaults.
+        """
+        validators = {}
+        for tool in self.tools:
+            function = tool["function"]
+            parameters = function["parameters"]
+            required = set(parameters.get("required", ()))
+            fields = {
+                name: (_SCHEMA_TYPES.get(spec.get("type"), Any), ... if name in required else None)
+                for name, spec in parameters["properties"].items()
+            }
+            model = create_model(f"{function['name']}_arguments", **fields)
+            validators[function["name"]] = (
+                lambda arguments, model=model: model.model_validate(arguments).model_dump(exclude_unset=True)
+            )
+        return validators
+    
+    def _call_function(self, function_name: str, arguments: Dict) -> str:
+        """Execute a function call, reusing earlier results of deterministic tools."""
+        function = self.available_functions.get(function_name)
+        if function is None:
             return f"Function {function_name} not available"
+        
+        try:
+            arguments = self._tool_validators[function_name](arguments)
+        except ValidationError as e:
+            return f"Invalid arguments for {function_name}: {e.errors()[0]['msg']}"
+        
+        cache_key = None
+        if function_name in CACHEABLE_TOOLS:
+            cache_key = (function_name, _dumps_canonical(arguments))
+            cached = self.tool_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        try:
+            result = function(**arguments)
+        except Exception as e:
+            return f"Error executing {function_name}: {str(e)}"
+        
+        if cache_key:
+            self.tool_cache.set(cache_key, result)
+        return result
+    
+    def _create_disk_cache(self):
+        """Create the optional persistent cache (AZURE_OPENAI_DISK_CACHE=true)."""
+        if os.getenv("AZURE_OPENAI_DISK_CACHE", "").lower() not in ["true", "1", "yes"]:
+            return None
+        
+        # The request body already pins the deployment; the namespace pins the API version
+        return DiskCache(self.cache_dir, namespace=self._client_options["api_version"])
+    
+    def _cache_get(self, cache_key: str):
+        """Look a response up in memory first, then on disk."""
+        cached = self.response_cache.get(cache_key)
+        if cached is None and self.disk_cache is not None:
+            cached = self.disk_cache.get(cache_key)
+            if cached is not None:
+                self.response_cache.set(cache_key, cached)
+        return cached
+    
+    def _cache_set(self, cache_key: str, response_dict: Dict):
+        """Store a response in memory and, when enabled, on disk."""
+        self.response_cache.set(cache_key, response_dict)
+        if self.disk_cache is not None:
+            self.disk_cache.set(cache_key, response_dict)
+    
+    def _create_semantic_cache(self):
+        """Create the optional embedding-based cache (AZURE_OPENAI_SEMANTIC_CACHE=true)."""
+        if os.getenv("AZURE_OPENAI_SEMANTIC_CACHE", "").lower() not in ["true", "1", "yes"]:
+            return None
+        
+        self.embedding_deployment = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME", "text-embedding-3-small")
+        local_model = os.getenv("AZURE_OPENAI_LOCAL_EMBEDDING_MODEL")
+        try:
+            embed = self._create_local_embedder(local_model) if local_model else self._embed
+            semantic_cache = SemanticCache(embed)
+        except ImportError as e:
+            print(f"⚠️  Semantic cache disabled: {e}")
+            return None
+        
+        # With the disk cache on, paraphrase matches also carry over between sessions
+        if self.disk_cache is not None:
+            embedding_name = (local_model or self.embedding_deployment).replace("/", "_")
+            self._semantic_cache_path = os.path.join(
+                self.cache_dir, f"semantic_{self.deployment_name}_{embedding_name}.npz"
+            )
+            semantic_cache.load(self._semantic_cache_path)
+        return semantic_cache
     
-    def chat(self, user_message: str) -> str:
-        """Send a message and get response, handling tool calls."""
+    def _create_local_embedder(self, model_name: str):
+        """Embed on this machine with a sentence-transformers model, so lookups cost no API call."""
+        try:
+            # Imported here: it pulls in torch, which only this option needs
+            sentence_transformers = importlib.import_module("sentence_transformers")
+        except ImportError:
+            raise ImportError("Local embeddings require sentence-transformers: pip install sentence-transformers")
+        
+        model = sentence_transformers.SentenceTransformer(model_name)
+        return lambda text: model.encode(text, normalize_embeddings=True)
+    
+    def _embed(self, text: str) -> List[float]:
+        """Embed text with the Azure embeddings deployment."""
+        response = self.client.embeddings.create(model=self.embedding_deployment, input=text)
+        return response.data[0].embedding
+    
+    def _semantic_text(self, request_data: Dict):
+        """Text to match semantically, or None when the request is not eligible.
+        
+        Near-duplicate reuse is only safe for deterministic, tool-free requests
+        made of plain system/user turns.
+        """
+        if self.semantic_cache is None or not self._is_cacheable(request_data) or request_data.get("tools"):
+            return None
+        if any(m["role"] not in ("system", "user") for m in request_data["messages"]):
+            return None
+        return "\n".join(m["content"] for m in request_data["messages"])
+    
+    def _is_cacheable(self, request_data: Dict) -> bool:
+        """Creative (higher temperature) or multi-sample (n > 1) requests must not be answered from a cache."""
+        if request_data.get("n", 1) > 1:
+            return False
+        temperature = request_data.get("temperature", 1)
+        return temperature is not None and temperature < self.cache_max_temperature
+    
+    def _dumps_request(self, request_data: Dict) -> bytes:
+        """Canonical request JSON, splicing in the pre-serialized tool schemas.
+        
+        The schemas are the bulk of every chat request body and never change, so
+        they are serialized once. Splicing is only valid while "tools" is the last
+        key in sorted order; anything else takes the plain path.
+        """
+        cached = self._tools_json.get(id(request_data.get("tools")))
+        if cached is not None and max(request_data) == "tools":
+            head = _dumps_canonical({k: v for k, v in request_data.items() if k != "tools"})
+            return head[:-1] + b',"tools":' + cached[1] + b"}"
+        return _dumps_canonical(request_data)
+    
+    def _prepare_request(self, request_data: Dict, use_cache: bool = True):
+        """Serialize a request once for both the log and the cache.
+        
+        Returns (request_body, cache_key); either is None when nothing needs it.
+        Only near-deterministic requests (below cache_max_temperature) get a cache key.
+        """
+        cacheable = use_cache and self._is_cacheable(request_data)
+        if not (self.enable_logging or cacheable):
+            return None, None
+        
+        request_body = self._dumps_request(request_data)
+        cache_key = self.response_cache.make_key(request_body) if cacheable else None
+        return request_body, cache_key
+    
+    def _base_request(self, tools: List[Dict] = None, max_completion_tokens: int = 500) -> Dict:
+        """Request fields that stay the same for a given call shape (everything but messages)."""
+        base = {
+            "model": self.deployment_name,
+            "max_completion_tokens": max_completion_tokens,
+            "temperature": self.temperature
+        }
+        if tools:
+            base["tools"] = tools
+        if self.use_prompt_cache_key:
+            base["prompt_cache_key"] = self._prompt_cache_key
+        return base
+    
+    def prepare_chat(self, tools: List[Dict] = None, max_completion_tokens: int = 500):
+        """Bind a request shape once and return call(messages, use_cache=True).
+        
+        The returned function behaves like _create_completion but skips rebuilding
+        the fixed request fields on every call.
+        """
+        base = self._base_request(tools, max_completion_tokens)
+        
+        def call(messages: List[Dict], use_cache: bool = True):
+            return self._send_chat({**base, "messages": messages}, use_cache)
+        
+        return call
+    
+    def _restricted_chat(self, restrict_to: List[str]):
+        """Prepared chat call offering only the named tools, built once per set of names."""
+        names = frozenset(restrict_to)
+        call = self._restricted_chats.get(names)
+        if call is None:
+            tools = [self._tools_by_name[name] for name in restrict_to]
+            self._tools_json[id(tools)] = (tools, _dumps_canonical(tools))
+            call = self._restricted_chats[names] = self.prepare_chat(tools=tools)
+        return call
+    
+    def _create_completion(self, messages: List[Dict], tools: List[Dict] = None,
+                           max_completion_tokens: int = 500, use_cache: bool = True):
+        """Create a chat completion, serving repeated deterministic requests from the cache.
+        
+        Returns (response, duration). Failed calls are logged and re-raised.
+        """
+        request_data = {**self._base_request(tools, max_completion_tokens), "messages": messages}
+        return self._send_chat(request_data, use_cache)
+    
+    def _send_chat(self, request_data: Dict, use_cache: bool = True, send=None):
+        """Send a fully built chat request through the caches; see _create_completion.
+        
+        send overrides self._send, e.g. to bypass endpoint failover.
+        """
+        request_body, cache_key = self._prepare_request(request_data, use_cache)
+        if cache_key:
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                return ChatCompletion.model_validate(cached), 0.0
+        
+        semantic_text = self._semantic_text(request_data) if use_cache else None
+        if semantic_text:
+            cached, embedding = self.semantic_cache.lookup(semantic_text)
+            if cached is not None:
+                return ChatCompletion.model_validate(cached), 0.0
+        
+        start_time = time.perf_counter()
+        try:
+            response, endpoint = (send or self._send)(request_data)
+        except Exception as e:
+            duration = time.perf_counter() - start_time
+            error_details = self._extract_error_details(e)
+            self._log_api_call(request_body, error_details=error_details, duration=duration)
+            raise
+        
+        duration = time.perf_counter() - start_time
+        self._record_usage(response.usage)
+        
+        # Only walk the pydantic model here when a cache needs the dict; a log-only
+        # call hands the model to the log writer, which dumps it off the request path
+        if cache_key or semantic_text:
+            response_dict = response.model_dump()
+            self._log_api_call(request_body, response_dict, duration=duration, endpoint=endpoint)
+        else:
+            self._log_api_call(request_body, response, duration=duration, endpoint=endpoint)
+        
+        if cache_key:
+            self._cache_set(cache_key, response_dict)
+        if semantic_text:
+            self.semantic_cache.store(embedding, response_dict)
+        
+        return response, duration
+    
+    def stream_completion(self, messages: List[Dict], tools: List[Dict] = None,
+                          max_completion_tokens: int = 500, on_tool_call=None):
+        """Yield reply text as it is generated instead of waiting for the whole response.
+        
+        Tool call fragments are stitched together by index. As soon as a call's
+        arguments form complete JSON, on_tool_call(tool_call, arguments) is invoked
+        so it can start while the rest of the reply is still streaming. The
+        generator's return value is (assistant message dict, finish_reason), and
+        the call is logged once after the stream ends. Streamed responses are not cached.
+        """
+        request_data = {**self._base_request(tools, max_completion_tokens), "messages": messages}
+        request_body, _ = self._prepare_request(request_data, use_cache=False)
+        
+        content_parts = []
+        tool_calls = {}
+        dispatched = set()
+        finish_reason = None
+        usage = None
+        response_id = None
+        
+        start_time = time.perf_counter()
+        try:
+            stream_request = {**request_data, "stream": True}
+            if _STREAM_USAGE_SUPPORTED:
+                stream_request["stream_options"] = {"include_usage": True}
+            stream, endpoint = self._send(stream_request)
+            for chunk in stream:
+                response_id = response_id or chunk.id
+                if getattr(chunk, "usage", None) is not None:
+                    self._record_usage(chunk.usage)
+                    usage = chunk.usage.model_dump()
+                if not chunk.choices:
+                    continue
+                
+                choice = chunk.choices[0]
+                delta = choice.delta
+                finish_reason = choice.finish_reason or finish_reason
+                
+                if delta.content:
+                    content_parts.append(delta.content)
+                    yield delta.content
+                
+                for tool_delta in delta.tool_calls or ():
+                    index = tool_delta.index
+                    call = tool_calls.setdefault(index, {
+                        "id": None, "type": "function", "function": {"name": "", "arguments": ""}
+                    })
+                    function = call["function"]
+                    if tool_delta.id:
+                        call["id"] = tool_delta.id
+                    function_delta = tool_delta.function
+                    if function_delta:
+                        function["name"] += function_delta.name or ""
+                        function["arguments"] += function_delta.arguments or ""
+                    
+                    # Only attempt a parse once the arguments could be a closed object
+                    raw_arguments = function["arguments"]
+                    if on_tool_call and index not in dispatched and raw_arguments.endswith("}"):
+                        try:
+                            arguments = _loads(raw_arguments)
+                        except ValueError:
+                            continue
+                        dispatched.add(index)
+                        on_tool_call(call, arguments)
+        
+        except Exception as e:
+            duration = time.perf_counter() - start_time
+            error_details = self._extract_error_details(e)
+            self._log_api_call(request_body, error_details=error_details, duration=duration)
+            raise
+        
+        duration = time.perf_counter() - start_time
+        
+        message = {"role": "assistant", "content": "".join(content_parts) or None}
+        if tool_calls:
+            message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+        
+        if self.enable_logging:
+            response_dict = {
+                "id": response_id,
+                "object": "chat.completion",
+                "model": self.deployment_name,
+                "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                "usage": usage
+            }
+            self._log_api_call(request_body, response_dict, duration=duration, endpoint=endpoint)
+        
+        return message, finish_reason
+    
+    def cache_stats(self) -> Dict[str, int]:
+        """Return response cache hit/miss/eviction counters."""
+        return self.response_cache.stats()
+    
+    def _record_usage(self, usage):
+        """Add a response's prompt token counts, including those the service served from its prompt cache."""
+        if usage is None:
+            return
+        
+        # Only reported by newer API/SDK versions
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (details.cached_tokens or 0) if details is not None else 0
+        totals = self._prompt_token_totals
+        totals["prompt_tokens"] += usage.prompt_tokens
+        totals["cached_tokens"] += cached
+        logger.debug("Prompt tokens: %d (%d from prompt cache)", usage.prompt_tokens, cached)
+    
+    def prompt_cache_stats(self) -> Dict[str, float]:
+        """Return prompt tokens sent so far, how many were cache hits, and the hit ratio."""
+        totals = self._prompt_token_totals
+        prompt_tokens = totals["prompt_tokens"]
+        return {**totals, "hit_ratio": totals["cached_tokens"] / prompt_tokens if prompt_tokens else 0.0}
+    
+    def _local_answer(self, user_message: str) -> Optional[str]:
+        """Answer bare arithmetic without a model round trip; None for anything else."""
+        expression = user_message.strip()
+        if not _PURE_MATH_RE.fullmatch(expression) or _NOT_MATH_RE.search(expression):
+            return None
+        
+        try:
+            answer = f"The result of {expression} is {_evaluate_math(expression)}"
+        except Exception:
+            return None
+        
+        self.conversation.append({"role": "assistant", "content": answer})
+        return answer
+    
+    def chat(self, user_message: str, restrict_to: List[str] = None) -> str:
+        """Send a message and get response, handling tool calls.
+        
+        restrict_to limits the tools offered to the model to the given names.
+        """
         # Add user message to conversation
         self.conversation.append({"role": "user", "content": user_message})
+        self._trim_history()
         
-        # Track timing for logging
-        start_time = time.time()
+        answer = self._local_answer(user_message)
+        if answer is not None:
+            return answer
         
         try:
-            # Make API call with tools
-            response = self.client.chat.completions.create(
-                model=self.deployment_name,
-                messages=self.conversation,
-                tools=self.tools,
-                max_completion_tokens=500,
-                temperature=1
-            )
-            
-            duration = time.time() - start_time
-            
-            # Log successful API call with timing
-            self._log_api_call(self.conversation, response.model_dump(), duration=duration)
+            # Make API call with tools (logged with timing)
+            send = self._restricted_chat(restrict_to) if restrict_to else self._chat_with_tools
+            response, _ = send(self.conversation)
             
             assistant_message = response.choices[0].message
             
             # Check if AI wants to call functions
             if assistant_message.tool_calls:
-                print("🔧 AI is using tools...")
-                
                 # Add assistant message with tool calls to conversation
-                self.conversation.append(assistant_message.model_dump())
+                message_dict = _tool_call_message(assistant_message)
+                self.conversation.append(message_dict)
+                self._run_tool_calls(message_dict["tool_calls"])
                 
-                # Execute each tool call
-                for tool_call in assistant_message.tool_calls:
-                    function_name = tool_call.function.name
-                    function_args = json.loads(tool_call.function.arguments)
-                    
-                    print(f"📞 Calling: {function_name}({function_args})")
-                    
-                    # Execute function
-                    function_result = self._call_function(function_name, function_args)
-                    
-                    # Add function result to conversation
-                    self.conversation.append({
-                        "tool_call_id": tool_call.id,
-                        "role": "tool",
-                        "content": function_result
-                    })
+                direct = self._direct_reply(message_dict["tool_calls"], response.choices[0].finish_reason)
+                if direct is not None:
+                    return direct
                 
                 # Get final response after function calls
-                start_time2 = time.time()
-                response2 = self.client.chat.completions.create(
-                    model=self.deployment_name,
-                    messages=self.conversation,
-                    max_completion_tokens=500,
-                    temperature=1
-                )
-                duration2 = time.time() - start_time2
-                
-                # Log the second API call
-                self._log_api_call(self.conversation, response2.model_dump(), duration=duration2)
+                response2, _ = self._chat_plain(self.conversation)
                 
                 final_message = response2.choices[0].message.content
                 self.conversation.append({"role": "assistant", "content": final_message})
@@ -437,16 +1324,520 @@ class SimpleChatApp:
                 return content
         
         except Exception as e:
-            duration = time.time() - start_time
+            # API failures were already logged with their HTTP details
+            error_msg = f"Error: {str(e)}"
+            return error_msg
+    
+    def clear_conversation(self):
+        """Drop the history but keep the cached prefix, reusing the same list object.
+        
+        The conversation list is passed to the client as-is on every turn (never
+        copied), so callers must not mutate it while a request is in flight.
+        """
+        self.conversation[len(self._prefix_messages):] = []
+        self._history_tokens.clear()
+    
+    def _trim_history(self):
+        """Drop the oldest whole turns once the history exceeds max_history_tokens or max_history_turns.
+        
+        A turn starts at a user message, so tool results are never separated from
+        the assistant message that requested them. The latest turn is always kept.
+        Trimming goes down to _HISTORY_TRIM_RATIO of the limits, so the history
+        prefix then stays unchanged (and prompt-cacheable) for several turns
+        instead of shifting by one turn on every request.
+        """
+        max_tokens, max_turns = self.max_history_tokens, self.max_history_turns
+        if not (max_tokens or max_turns):
+            return
+        
+        start = len(self._prefix_messages)
+        history = self.conversation[start:]
+        counts = self._history_tokens
+        counts.extend(_count_tokens(m) for m in history[len(counts):])
+        
+        total = sum(counts)
+        turns = sum(1 for m in history if m["role"] == "user")
+        if not ((max_tokens and total > max_tokens) or (max_turns and turns > max_turns)):
+            return
+        
+        max_tokens *= _HISTORY_TRIM_RATIO
+        max_turns = int(max_turns * _HISTORY_TRIM_RATIO)
+        drop = 0
+        while (max_tokens and total > max_tokens) or (max_turns and turns > max_turns):
+            # Find where the next turn begins
+            end = drop + 1
+            while end < len(history) and history[end]["role"] != "user":
+                end += 1
+            if end >= len(history):
+                break
+            total -= sum(counts[drop:end])
+            turns -= history[drop]["role"] == "user"
+            drop = end
+        
+        if drop:
+            del self.conversation[start:start + drop]
+            del counts[:drop]
+    
+    def chat_stream(self, user_message: str):
+        """Like chat(), but yields the reply in pieces as it is generated."""
+        self.conversation.append({"role": "user", "content": user_message})
+        self._trim_history()
+        
+        answer = self._local_answer(user_message)
+        if answer is not None:
+            yield answer
+            return
+        
+        started = {}
+        
+        def start_tool(tool_call: Dict, arguments: Dict):
+            # Announced together with the rest by _run_tool_calls once the stream ends
+            started[tool_call["id"]] = self._start_tool_call(tool_call["function"]["name"], arguments)
+        
+        try:
+            message, finish_reason = yield from self.stream_completion(
+                self.conversation, tools=self.tools, on_tool_call=start_tool)
             
-            # Extract detailed error information
-            error_details = self._extract_error_details(e)
+            if message.get("tool_calls"):
+                self.conversation.append(message)
+                self._run_tool_calls(message["tool_calls"], started)
+                direct = self._direct_reply(message["tool_calls"], finish_reason)
+                if direct is not None:
+                    yield direct
+                    return
+                message, _ = yield from self.stream_completion(self.conversation)
             
-            # Log error with actual HTTP details
-            self._log_api_call(self.conversation, error_details=error_details, duration=duration)
+            self.conversation.append({"role": "assistant", "content": message["content"]})
+        
+        except Exception as e:
+            # API failures were already logged with their HTTP details
+            yield f"Error: {str(e)}"
+    
+    def _direct_reply(self, tool_calls: List[Dict], finish_reason: Optional[str]) -> Optional[str]:
+        """Use a lone successful DIRECT_REPLY_TOOLS result as the reply; None if the model should write one.
+        
+        Only applies when the model stopped to call tools, not when the reply was
+        cut off or filtered, and never to an error result.
+        """
+        if finish_reason != "tool_calls" or len(tool_calls) != 1:
+            return None
+        
+        success_prefix = DIRECT_REPLY_TOOLS.get(tool_calls[0]["function"]["name"])
+        result = self.conversation[-1]["content"]
+        if success_prefix is None or not result.startswith(success_prefix):
+            return None
+        
+        self.conversation.append({"role": "assistant", "content": result})
+        return result
+    
+    def _start_tool_call(self, function_name: str, function_args: Dict, announce: bool = False):
+        """Submit one tool call to the pool and return its future."""
+        if announce:
+            self._say(f"📞 Calling: {function_name}({function_args})")
+        return self._tool_executor.submit(self._call_function, function_name, function_args)
+    
+    def _run_tool_calls(self, tool_calls: List[Dict], started: Dict = None):
+        """Execute tool calls and append each result to the conversation.
+        
+        Calls run concurrently; started maps tool call ids to futures that are
+        already running (e.g. dispatched mid-stream). Results are appended in the
+        order the model requested them. Progress for every call, including those
+        already started, is printed in one write.
+        """
+        started = started or {}
+        futures = []
+        lines = ["🔧 AI is using tools..."]
+        for tool_call in tool_calls:
+            function = tool_call["function"]
+            arguments = _loads(function["arguments"])
+            future = started.get(tool_call["id"])
+            if future is None:
+                future = self._start_tool_call(function["name"], arguments)
+            lines.append(f"📞 Calling: {function['name']}({arguments})")
+            futures.append(future)
+        self._say("\n".join(lines))
+        
+        # Add function results to conversation in one extend
+        self.conversation.extend(
+            {"tool_call_id": tool_call["id"], "role": "tool", "content": future.result()}
+            for tool_call, future in zip(tool_calls, futures)
+        )
+    
+    def _load_pool_options(self) -> List[Dict]:
+        """Client options for AZURE_OPENAI_ENDPOINT_2, _3, ... (keys default to the main key)."""
+        pool_options = []
+        index = 2
+        while os.getenv(f"AZURE_OPENAI_ENDPOINT_{index}"):
+            pool_options.append({
+                **self._client_options,
+                "azure_endpoint": os.getenv(f"AZURE_OPENAI_ENDPOINT_{index}"),
+                "api_key": os.getenv(f"AZURE_OPENAI_API_KEY_{index}", self._client_options["api_key"])
+            })
+            index += 1
+        return pool_options
+    
+    def _chat_url(self, client_options: Dict) -> str:
+        """Chat completions URL of the resource described by client_options."""
+        return (f"{client_options['azure_endpoint']}openai/deployments/{self.deployment_name}"
+                f"/chat/completions?api-version={client_options['api_version']}")
+    
+    def _send_primary(self, request_data: Dict):
+        """Send a chat request to the main endpoint only; returns (response, endpoint URL)."""
+        return self.client.chat.completions.create(**request_data), self._chat_endpoint
+    
+    def _create_chat_sender(self):
+        """Return send(request_data) -> (response, endpoint URL) for synchronous chat requests.
+        
+        With extra endpoints configured this is a failover pool over one client per
+        resource (all sharing the pooled HTTP connection client), else the main client.
+        Pooled clients don't retry themselves: a 429 moves on to the next resource
+        instead of waiting out Retry-After on the saturated one. The returned URL is
+        the one that served the request, for the log.
+        """
+        if not self._pool_options:
+            return self._send_primary
+        
+        senders = []
+        for options in [self._client_options, *self._pool_options]:
+            client = AzureOpenAI(**{**options, "max_retries": 0}, http_client=self._http)
             
-            error_msg = f"Error: {str(e)}"
-            return error_msg
+            def send(request_data, client=client, url=self._chat_url(options)):
+                return client.chat.completions.create(**request_data), url
+            senders.append(send)
+        return EndpointPool(senders).send_sync
+    
+    def _create_async_client(self, client_options: Dict = None) -> AsyncAzureOpenAI:
+        """Create an async client for concurrent batch requests.
+        
+        One client (and connection pool) serves a whole batch; with h2 installed the
+        concurrent requests are multiplexed over a few HTTP/2 connections.
+        """
+        http_client = httpx.AsyncClient(
+            http2=h2 is not None,
+            verify=not self.disable_ssl,
+            limits=self._http_limits
+        )
+        return AsyncAzureOpenAI(**(client_options or self._client_options), http_client=http_client)
+    
+    def _create_aiohttp_session(self):
+        """Create an aiohttp session that talks to the chat completions endpoint directly."""
+        connector = aiohttp.TCPConnector(
+            limit=self.max_concurrent_requests,
+            keepalive_timeout=120,
+            ttl_dns_cache=300,
+            ssl=False if self.disable_ssl else None
+        )
+        headers = {"api-key": self._client_options["api_key"], "Content-Type": "application/json"}
+        timeout = self._client_options["timeout"]
+        return aiohttp.ClientSession(
+            connector=connector,
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=timeout.read, connect=timeout.connect),
+            trust_env=True
+        )
+    
+    async def _apost_chat_completion(self, session, request_data: Dict) -> ChatCompletion:
+        """POST a chat completion over aiohttp and rebuild the SDK response object."""
+        url = self._chat_endpoint
+        request = httpx.Request("POST", url)
+        
+        try:
+            async with session.post(url, json=request_data) as resp:
+                status = resp.status
+                # aiohttp has already decompressed the body, so these no longer describe
+                # the text; httpx would otherwise try to decode it again
+                headers = {k: v for k, v in resp.headers.items()
+                           if k.lower() not in ("content-encoding", "content-length")}
+                text = await resp.text()
+        except asyncio.TimeoutError as e:
+            raise APITimeoutError(request=request) from e
+        except aiohttp.ClientError as e:
+            raise APIConnectionError(message=str(e), request=request) from e
+        
+        try:
+            body = _loads(text)
+        except ValueError:
+            body = text
+        
+        if status >= 400:
+            # Raise the same exception types the SDK would, so error handling stays uniform
+            error_types = {400: BadRequestError, 401: AuthenticationError, 404: NotFoundError, 429: RateLimitError}
+            error_type = error_types.get(status, InternalServerError if status >= 500 else APIStatusError)
+            response = httpx.Response(status, headers=headers, text=text, request=request)
+            raise error_type(f"Error code: {status} - {body}", response=response, body=body)
+        
+        return ChatCompletion.model_validate(body)
+    
+    async def _achat_once(self, send, semaphore: asyncio.Semaphore, prompt: str,
+                          overrides: Dict = None) -> str:
+        """Send a single-turn prompt (no history, no tools) through the batch transport.
+        
+        overrides replaces request fields such as temperature or max_completion_tokens;
+        its optional "system" key replaces the system prompt.
+        """
+        overrides = dict(overrides or {})
+        system_prompt = overrides.pop("system", SYSTEM_PROMPT)
+        if system_prompt != SYSTEM_PROMPT and self.use_prompt_cache_key:
+            overrides["prompt_cache_key"] = prefix_cache_key(system_prompt, self.static_context)
+        messages = build_cached_messages(system_prompt, self.static_context, prompt)
+        request_data = {**self._batch_request, **overrides, "messages": messages}
+        
+        request_body, cache_key = self._prepare_request(request_data)
+        if not cache_key:
+            return await self._achat_uncached(send, semaphore, request_data, request_body, cache_key)
+        
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached["choices"][0]["message"]["content"]
+        
+        # Identical deterministic requests already in flight share that one call
+        pending = self._inflight.get(cache_key)
+        if pending is None:
+            pending = asyncio.ensure_future(
+                self._achat_uncached(send, semaphore, request_data, request_body, cache_key)
+            )
+            self._inflight[cache_key] = pending
+            pending.add_done_callback(lambda _: self._inflight.pop(cache_key, None))
+        return await asyncio.shield(pending)
+    
+    async def _achat_uncached(self, send, semaphore: asyncio.Semaphore, request_data: Dict,
+                              request_body: bytes, cache_key: str) -> str:
+        """Answer from the semantic cache or the network; errors come back as "Error: ..." text."""
+        semantic_text = self._semantic_text(request_data)
+        if semantic_text:
+            # Embedding uses the sync client, so keep it off the event loop
+            cached, embedding = await asyncio.to_thread(self.semantic_cache.lookup, semantic_text)
+            if cached is not None:
+                return cached["choices"][0]["message"]["content"]
+        
+        async with semaphore:
+            start_time = time.perf_counter()
+            try:
+                response, endpoint = await send(request_data)
+                duration = time.perf_counter() - start_time
+                self._record_usage(response.usage)
+                if cache_key or semantic_text:
+                    response_dict = response.model_dump()
+                    self._log_api_call(request_body, response_dict, duration=duration, endpoint=endpoint)
+                else:
+                    self._log_api_call(request_body, response, duration=duration, endpoint=endpoint)
+                if cache_key:
+                    self._cache_set(cache_key, response_dict)
+                if semantic_text:
+                    self.semantic_cache.store(embedding, response_dict)
+                return response.choices[0].message.content
+            
+            except Exception as e:
+                duration = time.perf_counter() - start_time
+                error_details = self._extract_error_details(e)
+                self._log_api_call(request_body, error_details=error_details, duration=duration)
+                return f"Error: {str(e)}"
+    
+    async def _aretry(self, call, *args):
+        """Await call(*args), retrying transient failures with exponential backoff and jitter.
+        
+        The SDK clients retry on their own; this covers the direct aiohttp path.
+        A 429 or 503 means the whole resource is saturated, so it pauses every
+        request in the process (via _backoff_until), not just the one that got it.
+        """
+        max_retries = self._client_options["max_retries"]
+        for attempt in range(max_retries + 1):
+            wait = self._backoff_until - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                return await call(*args)
+            except (RateLimitError, APIConnectionError, InternalServerError) as e:
+                if attempt == max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                if isinstance(e, RateLimitError) or getattr(e, "status_code", None) == 503:
+                    self._backoff_until = max(self._backoff_until, time.monotonic() + delay)
+                else:
+                    await asyncio.sleep(delay)
+    
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        """Seconds to wait before retrying: the server's retry-after hint if any, else backoff with jitter."""
+        response = getattr(error, "response", None)
+        if response is not None:
+            headers = response.headers
+            try:
+                if "retry-after-ms" in headers:
+                    return min(float(headers["retry-after-ms"]) / 1000, _MAX_RETRY_DELAY)
+                if "retry-after" in headers:
+                    return min(float(headers["retry-after"]), _MAX_RETRY_DELAY)
+            except ValueError:
+                # An HTTP-date or garbage value; fall back to our own backoff
+                pass
+        return min(self.retry_base_delay * 2 ** attempt + random.uniform(0, 0.5), _MAX_RETRY_DELAY)
+    
+    @contextlib.asynccontextmanager
+    async def _batch_transport(self):
+        """Yield send(request_data) over aiohttp when installed, else the async SDK client.
+        
+        send returns (response, endpoint URL). With extra endpoints configured,
+        requests are spread over one non-retrying SDK client per resource instead
+        (the pool fails over), and the URL is that of the resource that served
+        the request.
+        """
+        if self._pool_options:
+            async with contextlib.AsyncExitStack() as stack:
+                senders = []
+                for client_options in [self._client_options, *self._pool_options]:
+                    client = await stack.enter_async_context(
+                        self._create_async_client({**client_options, "max_retries": 0}))
+                    
+                    async def send(request_data, client=client, url=self._chat_url(client_options)):
+                        return await client.chat.completions.create(**request_data), url
+                    senders.append(send)
+                yield EndpointPool(senders, self.max_concurrent_requests).send
+            return
+        
+        if _load_aiohttp() is not None:
+            async with self._create_aiohttp_session() as session:
+                async def send(request_data):
+                    return await self._aretry(self._apost_chat_completion, session, request_data), self._chat_endpoint
+                yield send
+            return
+        
+        async with self._create_async_client() as client:
+            async def send(request_data):
+                return await client.chat.completions.create(**request_data), self._chat_endpoint
+            yield send
+    
+    async def run_batch(self, prompts: List[str], overrides: Dict = None) -> List[str]:
+        """Answer independent prompts concurrently, returning replies in input order."""
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests * (1 + len(self._pool_options)))
+        
+        async with self._batch_transport() as send:
+            return await asyncio.gather(*[
+                self._achat_once(send, semaphore, prompt, overrides) for prompt in prompts
+            ])
+    
+    async def run_sweep(self, prompt: str, variants: List[Dict]) -> List[str]:
+        """Send one prompt with several parameter sets concurrently.
+        
+        Each variant overrides request fields, e.g. [{"temperature": 0.1}, {"temperature": 1.5}],
+        or the system prompt, e.g. [{"system": "Answer like a pirate."}, {"system": "Be terse."}].
+        Replies come back in variant order.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests * (1 + len(self._pool_options)))
+        
+        async with self._batch_transport() as send:
+            return await asyncio.gather(*[
+                self._achat_once(send, semaphore, prompt, overrides) for overrides in variants
+            ])
+    
+    def chat_batch(self, prompts: List[str]) -> List[str]:
+        """Synchronous wrapper around run_batch for non-async callers."""
+        return asyncio.run(self.run_batch(prompts))
+    
+    def chat_sweep(self, prompt: str, variants: List[Dict]) -> List[str]:
+        """Synchronous wrapper around run_sweep for non-async callers."""
+        return asyncio.run(self.run_sweep(prompt, variants))
+    
+    def chat_samples(self, prompt: str, n: int) -> List[str]:
+        """Get n alternative replies to one prompt from a single request (the n parameter).
+        
+        Input tokens are billed once for all n choices. Samples are never served
+        from or stored in the response caches. The conversation is not changed.
+        """
+        request_data = {
+            **self._batch_request,
+            "messages": [*self._prefix_messages, {"role": "user", "content": prompt}],
+            "n": n
+        }
+        response, _ = self._send_chat(request_data)
+        return [choice.message.content for choice in response.choices]
+    
+    def complete_batch(self, prompts: List[str], max_tokens: int = 100) -> List[str]:
+        """Complete many prompts with few round trips via the legacy completions API.
+        
+        Up to max_prompts_per_request prompts share one request; the response's
+        choices are mapped back to their prompts by index. Without a completions
+        deployment configured, each prompt is sent as a chat turn via run_batch.
+        """
+        if not self.completions_deployment:
+            replies = asyncio.run(self.run_batch(prompts, {"max_completion_tokens": max_tokens}))
+            return [reply.strip() if reply else "" for reply in replies]
+        
+        results = []
+        
+        for offset in range(0, len(prompts), self.max_prompts_per_request):
+            chunk = prompts[offset:offset + self.max_prompts_per_request]
+            request_data = {
+                "model": self.completions_deployment,
+                "prompt": chunk,
+                "max_tokens": max_tokens,
+                "temperature": self.temperature
+            }
+            request_body, _ = self._prepare_request(request_data, use_cache=False)
+            
+            start_time = time.perf_counter()
+            try:
+                response = self.client.completions.create(**request_data)
+            except Exception as e:
+                duration = time.perf_counter() - start_time
+                error_details = self._extract_error_details(e)
+                self._log_api_call(request_body, error_details=error_details, duration=duration,
+                                   endpoint=self._completions_endpoint)
+                results.extend([f"Error: {str(e)}"] * len(chunk))
+                continue
+            
+            duration = time.perf_counter() - start_time
+            if self.enable_logging:
+                self._log_api_call(request_body, response.model_dump(), duration=duration,
+                                   endpoint=self._completions_endpoint)
+            
+            texts = [""] * len(chunk)
+            for choice in response.choices:
+                texts[choice.index] = choice.text.strip()
+            results.extend(texts)
+        
+        return results
+    
+    def submit_batch(self, prompts: List[str]) -> List[str]:
+        """Answer prompts through the Azure Batch API and wait for the job to finish.
+        
+        Cheaper than live calls but can take up to 24 hours, so only use it for
+        latency-insensitive work. Replies come back in input order; prompts the
+        job could not answer get an "Error: ..." string.
+        """
+        lines = []
+        for i, prompt in enumerate(prompts):
+            body = {
+                **self._batch_request,
+                "model": self.batch_deployment,
+                "messages": build_cached_messages(SYSTEM_PROMPT, self.static_context, prompt)
+            }
+            lines.append(_dumps_canonical({"custom_id": f"req-{i}", "method": "POST", "url": "/chat/completions", "body": body}))
+        
+        batch_file = self.client.files.create(file=("batch.jsonl", b"\n".join(lines)), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id, endpoint="/chat/completions", completion_window="24h"
+        )
+        self._say(f"📦 Submitted batch {batch.id} with {len(prompts)} prompts")
+        
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(self.batch_poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+        
+        results = [f"Error: batch {batch.status}"] * len(prompts)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                item = _loads(line)
+                index = int(item["custom_id"].split("-", 1)[1])
+                response = item.get("response") or {}
+                if response.get("status_code") == 200:
+                    results[index] = response["body"]["choices"][0]["message"]["content"]
+                else:
+                    results[index] = f"Error: {item.get('error') or response.get('body')}"
+        
+        return results
     
     def _extract_error_details(self, exception) -> Dict:
         """Extract detailed error information from API exceptions."""
@@ -461,7 +1852,7 @@ class SimpleChatApp:
             if hasattr(exception, 'response') and exception.response:
                 error_details["status_code"] = exception.response.status_code
                 if hasattr(exception.response, 'headers'):
-                    error_details["response_headers"] = dict(exception.response.headers)
+                    error_details["response_headers"] = _sanitize_headers(exception.response.headers)
             
             if hasattr(exception, 'body') and exception.body:
                 error_details["error_body"] = exception.body
@@ -471,23 +1862,23 @@ class SimpleChatApp:
                     "code": getattr(exception, 'code', None)
                 }
             
-            print(f"🔍 Azure OpenAI API Error: Status {error_details['status_code']}")
-            print(f"   Details: {error_details['error_body']}")
+            self._say(f"🔍 Azure OpenAI API Error: Status {error_details['status_code']}")
+            self._say(f"   Details: {error_details['error_body']}")
             
         elif isinstance(exception, APIConnectionError):
             error_details["status_code"] = 503
             error_details["error_body"] = {"error": "Connection failed to Azure OpenAI", "details": str(exception)}
-            print(f"🔌 Connection Error: Cannot reach Azure OpenAI service")
+            self._say(f"🔌 Connection Error: Cannot reach Azure OpenAI service")
             
         elif isinstance(exception, RateLimitError):
             error_details["status_code"] = 429
             error_details["error_body"] = {"error": "Rate limit exceeded", "details": str(exception)}
-            print(f"⏱️ Rate Limit: Too many requests to Azure OpenAI")
+            self._say(f"⏱️ Rate Limit: Too many requests to Azure OpenAI")
             
         elif isinstance(exception, APITimeoutError):
             error_details["status_code"] = 408
             error_details["error_body"] = {"error": "Request timeout", "details": str(exception)}
-            print(f"⏰ Timeout: Request to Azure OpenAI timed out")
+            self._say(f"⏰ Timeout: Request to Azure OpenAI timed out")
         
         else:
             # Check for SSL certificate errors
@@ -495,24 +1886,28 @@ class SimpleChatApp:
             if "certificate" in error_str or "ssl" in error_str:
                 error_details["status_code"] = 502
                 error_details["error_body"] = {"error": "SSL Certificate Error", "details": str(exception)}
-                print(f"🔒 SSL Certificate Error (Corporate Network)")
-                print(f"   💡 Try: export DISABLE_SSL_VERIFY=true")
-                print(f"   💡 Or run: DISABLE_SSL_VERIFY=true python simple_chat.py")
-                print(f"   ⚠️  This disables SSL verification (use only in corporate environments)")
+                self._say(f"🔒 SSL Certificate Error (Corporate Network)")
+                self._say(f"   💡 Try: export DISABLE_SSL_VERIFY=true")
+                self._say(f"   💡 Or run: DISABLE_SSL_VERIFY=true python simple_chat.py")
+                self._say(f"   ⚠️  This disables SSL verification (use only in corporate environments)")
         
         return error_details
     
     def _show_logs(self):
         """Display recent API logs."""
-        log_file = "logs/api_requests.txt"
+        log_file = self.log_file
+        self._flush_logs()
         
         if not os.path.exists(log_file):
             print("📝 No logs found yet. Make an API call first to generate logs.\n")
             return
         
         try:
-            with open(log_file, "r", encoding="utf-8") as f:
-                content = f.read()
+            # Read only the tail, however large the log has grown
+            with open(log_file, "rb") as f:
+                size = f.seek(0, os.SEEK_END)
+                f.seek(max(0, size - 2000))
+                content = f.read().decode("utf-8", errors="replace")
             
             if not content.strip():
                 print("📝 Log file is empty.\n")
@@ -521,10 +1916,10 @@ class SimpleChatApp:
             print("📝 Recent API Logs:")
             print("=" * 50)
             
-            # Show last 2000 characters to avoid overwhelming output
-            if len(content) > 2000:
-                print("(Showing last 2000 characters)")
-                print("..." + content[-2000:])
+            # Show last 2000 bytes to avoid overwhelming output
+            if size > 2000:
+                print("(Showing last 2000 bytes)")
+                print("..." + content)
             else:
                 print(content)
                 
@@ -534,52 +1929,40 @@ class SimpleChatApp:
         except Exception as e:
             print(f"❌ Error reading log file: {e}\n")
     
-    def run(self):
-        """Run the chat application."""
-        print("🤖 Azure OpenAI Chat with Tool Calling")
-        print("=" * 50)
-        print("Available tools: weather, math calculator, random numbers, file explorer")
-        print("Type 'quit' to exit, 'clear' to reset conversation, 'logs' to view API logs")
-        print("Examples: 'What files are in this directory?' or 'List files in the logs folder'\n")
-        
+    def _test_connection(self) -> bool:
+        """Send a tiny request and explain likely causes if it fails."""
         # Test connection with detailed logging
         print("🔍 Testing connection to Azure OpenAI...")
-        print(f"   Endpoint: {os.getenv('AZURE_OPENAI_ENDPOINT')}")
+        print(f"   Endpoint: {self._client_options['azure_endpoint']}")
         print(f"   Deployment: {self.deployment_name}")
-        print(f"   API Version: {os.getenv('AZURE_OPENAI_API_VERSION', '2024-10-21')}")
+        print(f"   API Version: {self._client_options['api_version']}")
         
         test_messages = [{"role": "user", "content": "Hi"}]
-        start_time = time.time()
+        self._warm_connection()
+        start_time = time.perf_counter()
         
         try:
-            test_response = self.client.chat.completions.create(
-                model=self.deployment_name,
-                messages=test_messages,
-                max_completion_tokens=5,
-                temperature=1
-            )
-            duration = time.time() - start_time
-            
-            # Log successful connection test
-            self._log_api_call(test_messages, test_response.model_dump(), duration=duration)
+            # Always hit the network, and only the main endpoint: neither a cached
+            # reply nor a failover to AZURE_OPENAI_ENDPOINT_2.. would prove it works
+            test_request = {**self._base_request(max_completion_tokens=5), "messages": test_messages}
+            test_response, duration = self._send_chat(test_request, use_cache=False, send=self._send_primary)
             
             print("✅ Connected to Azure OpenAI successfully!")
             print(f"   Response: {test_response.choices[0].message.content}")
             print(f"   Tokens used: {test_response.usage.total_tokens}")
             print(f"   Response time: {duration:.3f}s")
-            print(f"   Logs saved to: logs/api_requests.txt")
+            if self.enable_logging:
+                print(f"   Logs saved to: {self.log_file}")
             print()
+            self._record_connection_ok()
             
         except Exception as e:
-            duration = time.time() - start_time
-            
-            # Extract and log detailed error information
-            error_details = self._extract_error_details(e)
-            self._log_api_call(test_messages, error_details=error_details, duration=duration)
+            duration = time.perf_counter() - start_time
             
             print(f"❌ Connection failed! Error: {str(e)[:100]}...")
             print(f"   Duration: {duration:.3f}s")
-            print(f"   Full error logged to: logs/api_requests.txt")
+            if self.enable_logging:
+                print(f"   Full error logged to: {self.log_file}")
             
             # Provide specific troubleshooting based on error type
             if isinstance(e, APIConnectionError):
@@ -610,22 +1993,39 @@ class SimpleChatApp:
             print(f"   5. Verify Azure OpenAI resource is active in portal")
             
             print(f"\n📚 Reference: https://learn.microsoft.com/en-us/azure/ai-foundry/openai/supported-languages")
+            return False
+        
+        return True
+    
+    def run(self):
+        """Run the chat application."""
+        print(_BANNER)
+        
+        if self.skip_connection_test:
+            # Still open the connection now so the first message doesn't pay for the handshake
+            self._warm_connection()
+            print("⏭️  Connection test skipped; errors will be reported on your first message\n")
+        elif self._connection_recently_verified():
+            self._warm_connection()
+            print("✅ Connection verified recently, skipping test request\n")
+        elif not self._test_connection():
             return
         
         while True:
             try:
                 user_input = input("You: ").strip()
+                command = user_input.lower()
                 
-                if user_input.lower() in ['quit', 'exit', 'q']:
+                if command in _QUIT_COMMANDS:
                     print("\nGoodbye! 👋")
                     break
                 
-                if user_input.lower() == 'clear':
-                    self.conversation = []
+                if command == 'clear':
+                    self.clear_conversation()
                     print("🗑️ Conversation cleared\n")
                     continue
                 
-                if user_input.lower() == 'logs':
+                if command == 'logs':
                     self._show_logs()
                     continue
                 
@@ -633,8 +2033,21 @@ class SimpleChatApp:
                     continue
                 
                 print("🤔 Thinking...")
-                response = self.chat(user_input)
-                print(f"🤖 Assistant: {response}\n")
+                if not self.stream_replies:
+                    response = self.chat(user_input)
+                    print(f"🤖 Assistant: {response}\n")
+                    continue
+                
+                # Print tokens as they arrive; the label waits for the first one
+                # so tool-call progress lines are not split
+                started = False
+                for piece in self.chat_stream(user_input):
+                    if not started:
+                        sys.stdout.write("🤖 Assistant: ")
+                        started = True
+                    sys.stdout.write(piece)
+                    sys.stdout.flush()
+                print("\n")
                 
             except KeyboardInterrupt:
                 print("\n\nGoodbye! 👋")
@@ -644,5 +2057,5 @@ class SimpleChatApp:
 
 
 if __name__ == "__main__":
-    app = SimpleChatApp()
-    app.run()
+    with SimpleChatApp() as app:
+        app.run()